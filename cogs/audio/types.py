@@ -42,10 +42,17 @@ class AudioTrack:
         self.volume_override = kwargs.get("volume")
         # Thumbnail URL for the track
         self.thumbnail = kwargs.get("thumbnail")
-        # User who requested the track
-        self.user = kwargs.get("user")
+        # User who requested the track (None if unknown)
+        self.user: Optional[discord.Member] = kwargs.get("user")
         # Link to display (YouTube or Spotify URL)
         self.link = kwargs.get("link") or self.youtube_url or self.spotify_url
+        # Name to display in messages, and a markdown link to the track if possible
+        self.display_name = self.title or self.name or "Unknown"
+        self.display_link = (
+            f"[{self.display_name}]({self.youtube_url})"
+            if self.youtube_url
+            else self.display_name
+        )
 
     def __str__(self):
         return f"{self.title} - {self.duration} - {self.youtube_url}"
@@ -173,7 +180,7 @@ class AudioQueue:
             symbol = "⭄" if self.position == start + i else "--"
 
             # Remove brackets from track title and limit length
-            title = (track.title or track.name or "Unknown")[:length].translate(
+            title = track.display_name[:length].translate(
                 str.maketrans(dict.fromkeys("[]()"))
             )
 
@@ -1,19 +1,48 @@
 """Music cog for music-related commands."""
 
+import asyncio
+import functools
+import inspect
+import time
 import typing
-from typing import TYPE_CHECKING, Optional, Union
+from typing import TYPE_CHECKING, Callable, Optional, Union
 
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-from cogs.audio.types import AudioPlayer, AudioQueue, RepeatMode
+from cogs.audio.types import (
+    AudioPlayer,
+    AudioPlayerStatus,
+    AudioQueue,
+    AudioTrack,
+    RepeatMode,
+)
 from cogs.audio.utils import format_duration, volume_bar
 from cogs.music.music_source import MusicSource
 
 if TYPE_CHECKING:
     from bot import DiscordBot
 
+# Emoji controls added to the now playing message.
+NOW_PLAYING_REACTIONS = (
+    "⏮️",  # previous
+    "▶️",  # resume
+    "⏸",  # pause
+    "⏭️",  # skip
+    "🛑",  # stop
+    "🔊",  # volume
+)
+
+# Emoji controls added to the volume message.
+VOLUME_REACTIONS = (
+    "⏬",  # volume down 5
+    "⬇",  # volume down 1
+    "⬆",  # volume up 1
+    "⏫",  # volume up 5
+    "✳",  # volume set 20
+)
+
 
 class MusicQueue(AudioQueue):
     """A queue for music."""
@@ -31,6 +60,28 @@ class MusicPlayer(AudioPlayer):
         # Now playing and volume messages
         self.np_message = None
         self.volume_message = None
+        # Monotonic clock bookkeeping for the current track's elapsed time
+        self._track_start_monotonic: Optional[float] = None
+        self._pause_accum = 0.0
+        self._paused_at: Optional[float] = None
+
+    def elapsed(self) -> float:
+        """Returns how many seconds of the current track have been played."""
+        if self._track_start_monotonic is None:
+            return 0.0
+        now = self._paused_at if self._paused_at is not None else time.monotonic()
+        return now - self._track_start_monotonic - self._pause_accum
+
+    def _mark_paused(self) -> None:
+        """Start counting paused time."""
+        if self._paused_at is None:
+            self._paused_at = time.monotonic()
+
+    def _mark_resumed(self) -> None:
+        """Stop counting paused time."""
+        if self._paused_at is not None:
+            self._pause_accum += time.monotonic() - self._paused_at
+            self._paused_at = None
 
     async def send_now_playing(
         self, text_channel: discord.TextChannel
@@ -52,37 +103,27 @@ class MusicPlayer(AudioPlayer):
 
         # Add user's name and track duration to footer (if user info is available)
         footer_parts = []
-        if hasattr(track, "user") and track.user:
-            duration = format_duration(track.duration - track.position)
+        footer_icon = None
+        if track.user:
+            duration = format_duration(max(0, track.duration - self.elapsed()))
             footer_parts.append(f"@{track.user.display_name} ({duration})")
+            footer_icon = (
+                track.user.display_avatar.with_size(64).with_static_format("png").url
+            )
 
         # Add "Up next" to footer if something is in the queue
         if len(self.queue.tracks) > self.queue.position + 1:
             next_track = self.queue.tracks[self.queue.position + 1]
-            footer_parts.append(
-                f"Up next: {next_track.title or next_track.name or 'Unknown'}"
-            )
+            footer_parts.append(f"Up next: {next_track.display_name}")
 
         footer = " ".join(footer_parts) if footer_parts else None
-        footer_icon = None
-        if hasattr(track, "user") and track.user:
-            footer_icon = (
-                track.user.display_avatar.with_size(64).with_static_format("png").url
-            )
-
-        # Create a link using the track name.
-        link = (
-            f"[{track.title}]({track.youtube_url})"
-            if track.youtube_url
-            else track.title
-        )
 
         # Send the new message
         self.np_message = await self.bot.messaging.send_embed(
             channel=text_channel,
             color=0xFF69B4,
             title="Now Playing ♫",
-            text=link,
+            text=track.display_link,
             thumbnail=track.thumbnail,
             footer=footer,
             footer_icon=footer_icon,
@@ -91,15 +132,7 @@ class MusicPlayer(AudioPlayer):
         # Add emoji controls
         if self.np_message:
             await self.bot.messaging.add_reactions(
-                self.np_message,
-                [
-                    "⏮️",  # previous
-                    "▶️",  # resume
-                    "⏸",  # pause
-                    "⏭️",  # skip
-                    "🛑",  # stop
-                    "🔊",  # volume
-                ],
+                self.np_message, NOW_PLAYING_REACTIONS
             )
 
         return self.np_message
@@ -107,6 +140,9 @@ class MusicPlayer(AudioPlayer):
     async def update_now_playing_status(self, title: str) -> None:
         """Updates the now playing message title (e.g., 'Now Playing' vs 'Now Paused')"""
         if self.np_message and self.np_message.embeds:
+            # Skip the API call if the title is already up to date (e.g. double pause)
+            if self.np_message.embeds[0].title == title:
+                return
             try:
                 await self.bot.messaging.edit_embed(
                     message=self.np_message, title=title
@@ -133,14 +169,7 @@ class MusicPlayer(AudioPlayer):
         # Add emoji controls
         if self.volume_message:
             await self.bot.messaging.add_reactions(
-                self.volume_message,
-                [
-                    "⏬",  # volume down 5
-                    "⬇",  # volume down 1
-                    "⬆",  # volume up 1
-                    "⏫",  # volume up 5
-                    "✳",  # volume set 20
-                ],
+                self.volume_message, VOLUME_REACTIONS
             )
 
         return self.volume_message
@@ -164,14 +193,34 @@ class MusicPlayer(AudioPlayer):
             pass
 
     # Override methods to work with now playing messages
+    async def play(self, channel: discord.VoiceChannel) -> None:
+        """Starts playback in the given voice channel."""
+        previous_source = self.current_source
+        await super().play(channel)
+
+        # A new source means a new track started playing.
+        if (
+            self.current_source is not None
+            and self.current_source is not previous_source
+        ):
+            self._track_start_monotonic = time.monotonic()
+            self._pause_accum = 0.0
+            self._paused_at = None
+        elif self.status == AudioPlayerStatus.PLAYING:
+            self._mark_resumed()
+
     async def pause(self) -> None:
         """Pause playback."""
         await super().pause()
+        if self.status == AudioPlayerStatus.PAUSED:
+            self._mark_paused()
         await self.update_now_playing_status("Now Paused ♫")
 
     async def resume(self) -> None:
         """Resume playback."""
         await super().resume()
+        if self.status == AudioPlayerStatus.PLAYING:
+            self._mark_resumed()
         await self.update_now_playing_status("Now Playing ♫")
 
     async def stop(self) -> None:
@@ -187,6 +236,39 @@ class MusicPlayer(AudioPlayer):
             self.volume_message = None
 
 
+def guild_command(func: Callable) -> Callable:
+    """Decorator for Music slash commands that can only be used in a server.
+    Sends an error outside of a server, otherwise passes the guild's MusicPlayer
+    to the command as the argument after the interaction."""
+
+    @functools.wraps(func)
+    async def wrapper(
+        self: "Music",
+        interaction: discord.Interaction,
+        *args: typing.Any,
+        **kwargs: typing.Any,
+    ):
+        if interaction.guild is None:
+            return await self.bot.messaging.send_error(
+                interaction,
+                text="This command can only be used in a server.",
+            )
+        player = self.get_music_player(interaction.guild)
+        return await func(self, interaction, player, *args, **kwargs)
+
+    # Hide the player argument so discord doesn't register it as a command option.
+    signature = inspect.signature(func)
+    parameters = list(signature.parameters.values())
+    if len(parameters) < 3 or parameters[2].name != "player":
+        raise TypeError(
+            f"{func.__name__} must take (self, interaction, player, ...) "
+            "to be a guild_command"
+        )
+    del parameters[2]
+    wrapper.__signature__ = signature.replace(parameters=parameters)  # type: ignore
+    return wrapper
+
+
 class Music(commands.Cog):
     """A cog for music-related commands."""
 
@@ -200,6 +282,10 @@ class Music(commands.Cog):
         # Music-specific player management
         self.music_players = {}  # type: typing.Dict[discord.Guild, MusicPlayer]
 
+    async def cog_unload(self):
+        """Close the music source's connections when the cog is unloaded."""
+        await self.music_source.close()
+
     def get_music_player(self, guild: discord.Guild) -> MusicPlayer:
         """Get or create a MusicPlayer for the guild."""
         if guild not in self.music_players:
@@ -209,7 +295,7 @@ class Music(commands.Cog):
     async def _update_queued_message(
         self,
         message: discord.Message,
-        tracks: list[typing.Any],
+        tracks: list[AudioTrack],
         query: str,
         playlist: Optional[dict[str, typing.Any]] = None,
     ) -> None:
@@ -217,14 +303,7 @@ class Music(commands.Cog):
         self.bot.log(f"Updating queued message for {tracks}")
         # Generate the response based on number of tracks and playlist info
         if len(tracks) == 1:
-            track = tracks[0]
-            # Create a link using the track name and url if available
-            link = (
-                f"[{track.title}]({track.youtube_url})"
-                if hasattr(track, "youtube_url") and track.youtube_url
-                else track.title
-            )
-            response = f"Queued {link}"
+            response = f"Queued {tracks[0].display_link}"
         elif playlist is not None:
             response = f"Queued **{len(tracks)}** tracks from [{playlist['name']}]({playlist['external_urls']['spotify']})"
         else:
@@ -240,27 +319,13 @@ class Music(commands.Cog):
             color=discord.Color.green(),
         )
 
-    async def _ensure_guild_command(self, interaction: discord.Interaction) -> bool:
-        """Check if the command is being used in a server. Send error and return False if not."""
-        if not interaction.guild:
-            await self.bot.messaging.send_error(
-                interaction,
-                text="This command can only be used in a server.",
-            )
-            return False
-        return True
-
     @app_commands.command(
         name="shuffle",
         description="Shuffles the queue.",
     )
-    async def shuffle(self, interaction: discord.Interaction):
+    @guild_command
+    async def shuffle(self, interaction: discord.Interaction, player: MusicPlayer):
         """Shuffle the queue."""
-        if not await self._ensure_guild_command(interaction):
-            return
-        assert interaction.guild is not None  # Type guard
-
-        player = self.get_music_player(interaction.guild)
         await player.queue.shuffle()
         await self.bot.messaging.send_embed(
             interaction,
@@ -273,17 +338,14 @@ class Music(commands.Cog):
         name="repeat",
         description="Sets the repeat mode of the player.",
     )
+    @guild_command
     async def repeat(
         self,
         interaction: discord.Interaction,
+        player: MusicPlayer,
         mode: RepeatMode,
     ):
         """Set the repeat mode of the player."""
-        if not await self._ensure_guild_command(interaction):
-            return
-        assert interaction.guild is not None  # Type guard
-
-        player = self.get_music_player(interaction.guild)
         player.queue.repeat_mode = mode
         await self.bot.messaging.send_embed(
             interaction,
@@ -296,13 +358,11 @@ class Music(commands.Cog):
         name="volume",
         description="Sets the volume of the player.",
     )
-    async def volume(self, interaction: discord.Interaction, volume: int):
+    @guild_command
+    async def volume(
+        self, interaction: discord.Interaction, player: MusicPlayer, volume: int
+    ):
         """Set the volume of the player."""
-        if not await self._ensure_guild_command(interaction):
-            return
-        assert interaction.guild is not None  # Type guard
-
-        player = self.get_music_player(interaction.guild)
         player.set_volume(volume / 100)
 
         # Send volume message
@@ -315,14 +375,9 @@ class Music(commands.Cog):
         name="nowplaying",
         description="Displays the currently playing track.",
     )
-    async def nowplaying(self, interaction: discord.Interaction):
+    @guild_command
+    async def nowplaying(self, interaction: discord.Interaction, player: MusicPlayer):
         """Display the currently playing track."""
-        if not await self._ensure_guild_command(interaction):
-            return
-        assert interaction.guild is not None  # Type guard
-
-        player = self.get_music_player(interaction.guild)
-
         # Send now playing message
         if isinstance(interaction.channel, discord.TextChannel):
             await player.send_now_playing(interaction.channel)
@@ -331,13 +386,9 @@ class Music(commands.Cog):
         name="queue",
         description="Displays the current queue.",
     )
-    async def queue(self, interaction: discord.Interaction):
+    @guild_command
+    async def queue(self, interaction: discord.Interaction, player: MusicPlayer):
         """Display the current queue."""
-        if not await self._ensure_guild_command(interaction):
-            return
-        assert interaction.guild is not None  # Type guard
-
-        player = self.get_music_player(interaction.guild)
         # Use the built-in format_queue method for better formatting
         queue_text = player.queue.format_queue()
         await self.bot.messaging.send_embed(
@@ -351,13 +402,9 @@ class Music(commands.Cog):
         name="stop",
         description="Stops playback and clears the queue.",
     )
-    async def stop(self, interaction: discord.Interaction):
+    @guild_command
+    async def stop(self, interaction: discord.Interaction, player: MusicPlayer):
         """Stop playback and clear the queue."""
-        if not await self._ensure_guild_command(interaction):
-            return
-        assert interaction.guild is not None  # Type guard
-
-        player = self.get_music_player(interaction.guild)
         await player.stop()
         await self.bot.messaging.send_embed(
             interaction,
@@ -370,13 +417,11 @@ class Music(commands.Cog):
         name="skip",
         description="Skips the currently playing track.",
     )
-    async def skip(self, interaction: discord.Interaction, count: int = 1):
+    @guild_command
+    async def skip(
+        self, interaction: discord.Interaction, player: MusicPlayer, count: int = 1
+    ):
         """Skip the currently playing track."""
-        if not await self._ensure_guild_command(interaction):
-            return
-        assert interaction.guild is not None  # Type guard
-
-        player = self.get_music_player(interaction.guild)
         skipped_tracks = await player.skip(count)
         if skipped_tracks:
             await self.bot.messaging.send_embed(
@@ -397,13 +442,9 @@ class Music(commands.Cog):
         name="resume",
         description="Resumes the currently paused track.",
     )
-    async def resume(self, interaction: discord.Interaction):
+    @guild_command
+    async def resume(self, interaction: discord.Interaction, player: MusicPlayer):
         """Resume the currently paused track."""
-        if not await self._ensure_guild_command(interaction):
-            return
-        assert interaction.guild is not None  # Type guard
-
-        player = self.get_music_player(interaction.guild)
         await player.resume()
         await self.bot.messaging.send_embed(
             interaction,
@@ -416,13 +457,9 @@ class Music(commands.Cog):
         name="pause",
         description="Pauses the currently playing track.",
     )
-    async def pause(self, interaction: discord.Interaction):
+    @guild_command
+    async def pause(self, interaction: discord.Interaction, player: MusicPlayer):
         """Pause the currently playing track."""
-        if not await self._ensure_guild_command(interaction):
-            return
-        assert interaction.guild is not None  # Type guard
-
-        player = self.get_music_player(interaction.guild)
         await player.pause()
         await self.bot.messaging.send_embed(
             interaction,
@@ -521,16 +558,16 @@ class Music(commands.Cog):
         track.user = interaction.user
         player.queue.add(track)
 
-        # Send queued message
-        await self._update_queued_message(
-            message=reply,
-            tracks=[track],
-            query=query,
-        )
-
-        # Play the track
+        # Send queued message and start playing the track at the same time
         self.bot.log(f"Playing {track} in {voice_channel}")
-        await player.play(voice_channel)
+        await asyncio.gather(
+            self._update_queued_message(
+                message=reply,
+                tracks=[track],
+                query=query,
+            ),
+            player.play(voice_channel),
+        )
 
         # Send now playing message
         await player.send_now_playing(interaction.channel)
@@ -21,6 +21,10 @@ class MusicSource:
             spotify_client_id, spotify_client_secret, self.youtube
         )
 
+    async def close(self) -> None:
+        """Close any open connections."""
+        await self.youtube.close()
+
     async def get_track(self, query: str) -> Optional[AudioTrack]:
         """Get a track from a query string.
 
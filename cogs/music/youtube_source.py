@@ -1,15 +1,19 @@
 """YouTube music source."""
 
 import asyncio
-import functools
+import concurrent.futures
 import html
 import logging
+import multiprocessing
+import os
 import re
+import time
 import urllib.parse
-from typing import Any, List, Optional
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 
+import aiohttp
 import isodate
-import pyyoutube
 import yt_dlp
 
 from ..audio.types import AudioTrack
@@ -36,52 +40,170 @@ STREAMING_YTDL_OPTIONS = {
     "outtmpl": "%(extractor)s-%(id)s-%(title)s.%(ext)s",
 }
 
+# The YoutubeDL instance of the current worker process, created on first use.
+_ydl: Optional[yt_dlp.YoutubeDL] = None
+
+
+def _extract_streaming_url(youtube_url: str) -> str:
+    """Extract the streaming URL from a YouTube URL. Runs in a yt-dlp pool worker.
+
+    Only the URL is returned so the full info dict isn't pickled back to the bot.
+    """
+    global _ydl
+    if _ydl is None:
+        _ydl = yt_dlp.YoutubeDL(STREAMING_YTDL_OPTIONS)
+    try:
+        info = _ydl.extract_info(youtube_url, download=False)
+    except Exception as e:
+        # yt-dlp errors carry a traceback, which can't be pickled back to the bot,
+        # so only the message is sent.
+        raise ValueError(str(e)) from None
+
+    if info and "url" in info:
+        return info["url"]
+    elif info and "formats" in info and info["formats"]:
+        # Try to get the best audio format manually
+        formats = info["formats"]
+        audio_formats = [f for f in formats if f.get("acodec") != "none"]
+        if audio_formats:
+            best_format = audio_formats[0]  # yt-dlp orders them by quality
+            return best_format["url"]
+        else:
+            raise ValueError("No audio formats found")
+    else:
+        raise ValueError("Failed to extract streaming URL from YouTube")
+
+
+# Matches the playlist ID in a YouTube playlist URL
+PLAYLIST_ID_REGEX = re.compile(r"list=([^&]+)")
+
+# Base URL of the YouTube Data API
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
+
+# Streaming URLs are signed for ~6 hours, so cache them for a bit less than that.
+STREAMING_URL_TTL = 4 * 60 * 60
+STREAMING_URL_CACHE_SIZE = 512
+
+# Maximum number of video IDs the videos endpoint accepts per request
+MAX_VIDEOS_PER_REQUEST = 50
+
+# Maximum number of tracks resolved at the same time when loading a playlist
+MAX_CONCURRENT_LOOKUPS = 8
+
 
 class YouTubeSource:
     """A music source for YouTube."""
 
     def __init__(self, api_key: str):
-        self.api = pyyoutube.Api(api_key=api_key)
+        self.api_key = api_key
+        # Created on first use, since it needs a running event loop.
+        self._http: Optional[aiohttp.ClientSession] = None
+        # YouTube URL -> (expiry time, streaming URL), least recently used first
+        self._streaming_urls: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+        # Locks so concurrent requests for the same video share one extraction
+        self._streaming_url_locks: Dict[str, asyncio.Lock] = {}
+        # yt-dlp extraction is CPU heavy (signature decoding), so it runs in worker
+        # processes instead of threads to avoid contending for the GIL. Created on
+        # first use, and again if a worker dies and breaks the pool.
+        self._ytdl_pool: Optional[concurrent.futures.ProcessPoolExecutor] = None
 
-    def _safe_get_items(self, result: Any) -> List[Any]:
-        """Safely get items from a pyyoutube result object."""
-        if not result:
-            return []
+    async def close(self) -> None:
+        """Close the HTTP session and stop the yt-dlp worker processes."""
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+        if self._ytdl_pool is not None:
+            self._ytdl_pool.shutdown(wait=False, cancel_futures=True)
+            self._ytdl_pool = None
 
+    def _get_ytdl_pool(self) -> concurrent.futures.ProcessPoolExecutor:
+        """Returns the yt-dlp worker pool, creating it if needed."""
+        if self._ytdl_pool is None:
+            self._ytdl_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._ytdl_pool
+
+    async def _run_ytdl(self, youtube_url: str) -> str:
+        """Extract a streaming URL in the yt-dlp worker pool.
+
+        If a worker died (e.g. killed for memory), the pool is broken for good, so
+        it is replaced and the extraction retried once.
+        """
+        loop = asyncio.get_running_loop()
+        pool = self._get_ytdl_pool()
         try:
-            # Try accessing as property first
-            items = result.items
-            if callable(items):
-                # If it's a method, call it
-                items = items()
-            return list(items) if items else []
-        except (AttributeError, TypeError):
-            return []
+            return await loop.run_in_executor(pool, _extract_streaming_url, youtube_url)
+        except concurrent.futures.process.BrokenProcessPool:
+            # Concurrent extractions fail together; only the first replaces the pool.
+            if self._ytdl_pool is pool:
+                logging.warning("yt-dlp worker pool broke, restarting it")
+                pool.shutdown(wait=False, cancel_futures=True)
+                self._ytdl_pool = None
+            return await loop.run_in_executor(
+                self._get_ytdl_pool(), _extract_streaming_url, youtube_url
+            )
+
+    async def _api_get(self, endpoint: str, **params: Any) -> dict:
+        """Make a request to the YouTube Data API and return the JSON response.
+
+        Args:
+            endpoint: The API endpoint, e.g. "videos"
+            params: Query parameters for the request
+
+        Returns:
+            dict: The decoded JSON response
+        """
+        if self._http is None or self._http.closed:
+            self._http = aiohttp.ClientSession()
+        params["key"] = self.api_key
+        async with self._http.get(
+            f"{YOUTUBE_API_URL}/{endpoint}", params=params
+        ) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    def _get_cached_streaming_url(self, youtube_url: str) -> Optional[str]:
+        """Returns the cached streaming URL for a YouTube URL, if it hasn't expired."""
+        entry = self._streaming_urls.get(youtube_url)
+        if entry is None:
+            return None
+        expires_at, streaming_url = entry
+        if expires_at < time.monotonic():
+            del self._streaming_urls[youtube_url]
+            return None
+        self._streaming_urls.move_to_end(youtube_url)
+        return streaming_url
 
     async def extract_streaming_url(self, youtube_url: str) -> str:
         """Extract the actual streaming URL from a YouTube URL."""
-        # Run yt-dlp extraction in executor to avoid blocking
-        loop = asyncio.get_event_loop()
-        extract_func = functools.partial(
-            yt_dlp.YoutubeDL(STREAMING_YTDL_OPTIONS).extract_info,
-            youtube_url,
-            download=False,
-        )
-        info = await loop.run_in_executor(None, extract_func)
-
-        if info and "url" in info:
-            return info["url"]
-        elif info and "formats" in info and info["formats"]:
-            # Try to get the best audio format manually
-            formats = info["formats"]
-            audio_formats = [f for f in formats if f.get("acodec") != "none"]
-            if audio_formats:
-                best_format = audio_formats[0]  # yt-dlp orders them by quality
-                return best_format["url"]
-            else:
-                raise ValueError("No audio formats found")
-        else:
-            raise ValueError("Failed to extract streaming URL from YouTube")
+        streaming_url = self._get_cached_streaming_url(youtube_url)
+        if streaming_url is not None:
+            return streaming_url
+
+        # Concurrent requests for the same video wait for a single extraction.
+        lock = self._streaming_url_locks.setdefault(youtube_url, asyncio.Lock())
+        try:
+            async with lock:
+                streaming_url = self._get_cached_streaming_url(youtube_url)
+                if streaming_url is not None:
+                    return streaming_url
+
+                # Run yt-dlp extraction in a worker process to avoid blocking
+                streaming_url = await self._run_ytdl(youtube_url)
+
+                # Cache the URL, evicting the least recently used ones
+                self._streaming_urls[youtube_url] = (
+                    time.monotonic() + STREAMING_URL_TTL,
+                    streaming_url,
+                )
+                while len(self._streaming_urls) > STREAMING_URL_CACHE_SIZE:
+                    self._streaming_urls.popitem(last=False)
+                return streaming_url
+        finally:
+            if self._streaming_url_locks.get(youtube_url) is lock:
+                del self._streaming_url_locks[youtube_url]
 
     async def get_track(self, query: str) -> Optional[AudioTrack]:
         """Get a track from a query string."""
@@ -93,19 +215,11 @@ class YouTubeSource:
         """Converts a query to a track"""
         # Search youtube
         try:
-            results = self.api.search_by_keywords(
-                q=query, search_type=["video"], count=5, limit=5
+            results = await self._api_get(
+                "search", part="snippet", q=query, type="video", maxResults=5
             )
-            items = self._safe_get_items(results)
-            if not items:
-                return None
-
-            for item in items:
-                if not hasattr(item, "id") or not hasattr(item.id, "videoId"):
-                    continue
-                video_id = item.id.videoId
-                if not video_id:
-                    continue
+            for item in results.get("items", []):
+                video_id = item["id"]["videoId"]
                 track = await self.id_to_track(video_id, query)
                 if track:
                     return track
@@ -115,38 +229,48 @@ class YouTubeSource:
             logging.error(f"Failed to search youtube for '{query}': {e}")
             return None
 
+    async def get_videos(self, video_ids: List[str]) -> List[dict]:
+        """Get the video resources for a list of video IDs.
+
+        The API accepts up to 50 IDs per request, so the IDs are fetched in batches.
+        """
+        batches = [
+            video_ids[i : i + MAX_VIDEOS_PER_REQUEST]
+            for i in range(0, len(video_ids), MAX_VIDEOS_PER_REQUEST)
+        ]
+        responses = await asyncio.gather(
+            *(
+                self._api_get(
+                    "videos", part="snippet,contentDetails", id=",".join(batch)
+                )
+                for batch in batches
+            )
+        )
+        return [video for response in responses for video in response.get("items", [])]
+
     async def id_to_track(self, video_id: str, query: str) -> Optional[AudioTrack]:
         """Get a track from a video ID."""
         try:
-            videos = self.api.get_video_by_id(video_id=video_id)
-            items = self._safe_get_items(videos)
-            if not items:
+            videos = await self.get_videos([video_id])
+            if not videos:
                 return None
+            return await self.video_to_track(videos[0], query)
+        except Exception as e:
+            logging.error(f"Failed to get video details for '{video_id}': {e}")
+            return None
 
-            video = items[0]
-            if (
-                not video
-                or not hasattr(video, "snippet")
-                or not hasattr(video, "contentDetails")
-                or not video.snippet
-                or not video.contentDetails
-                or not hasattr(video.snippet, "thumbnails")
-                or not video.snippet.thumbnails
-                or not hasattr(video.snippet.thumbnails, "high")
-                or not video.snippet.thumbnails.high
-            ):
-                return None
-
-            # Safely get the title with type checking
-            title_raw = getattr(video.snippet, "title", None)
-            if not title_raw or not isinstance(title_raw, str):
-                return None
-            title = html.unescape(title_raw)
-
+    async def video_to_track(self, video: dict, query: str) -> Optional[AudioTrack]:
+        """Get a track from a video resource returned by the API."""
+        video_id = video.get("id")
+        try:
+            snippet = video["snippet"]
+            title = html.unescape(snippet["title"])
             duration = int(
-                isodate.parse_duration(video.contentDetails.duration).total_seconds()
+                isodate.parse_duration(
+                    video["contentDetails"]["duration"]
+                ).total_seconds()
             )
-            thumbnail = video.snippet.thumbnails.high.url
+            thumbnail = snippet["thumbnails"]["high"]["url"]
             youtube_url = f"https://youtu.be/{video_id}"
 
             # Extract streaming URL
@@ -172,8 +296,9 @@ class YouTubeSource:
         """Converts a video URL to a track"""
         try:
             parsed = urllib.parse.urlparse(url)
-            if "v" in urllib.parse.parse_qs(parsed.query):
-                video_id = urllib.parse.parse_qs(parsed.query)["v"][0]
+            query_params = urllib.parse.parse_qs(parsed.query)
+            if "v" in query_params:
+                video_id = query_params["v"][0]
             else:
                 video_id = parsed.path.lstrip("/")
             return await self.id_to_track(video_id, url)
@@ -184,30 +309,38 @@ class YouTubeSource:
     async def get_playlist(self, url: str) -> List[AudioTrack]:
         """Get tracks from a playlist URL."""
         try:
-            playlist_id_match = re.search(r"list=([^&]+)", url)
+            playlist_id_match = PLAYLIST_ID_REGEX.search(url)
             if not playlist_id_match:
                 return []
             playlist_id = playlist_id_match.group(1)
-            playlist = self.api.get_playlist_items(playlist_id=playlist_id, count=None)
-            items = self._safe_get_items(playlist)
+            # Page through the whole playlist, 50 items at a time
+            items: List[dict] = []
+            params = {"part": "snippet", "playlistId": playlist_id, "maxResults": 50}
+            while True:
+                page = await self._api_get("playlistItems", **params)
+                items.extend(page.get("items", []))
+                if not page.get("nextPageToken"):
+                    break
+                params["pageToken"] = page["nextPageToken"]
             if not items:
                 return []
 
-            tracks = []
-            for item in items:
-                if (
-                    item
-                    and hasattr(item, "snippet")
-                    and item.snippet
-                    and hasattr(item.snippet, "resourceId")
-                    and item.snippet.resourceId
-                    and hasattr(item.snippet.resourceId, "videoId")
-                    and item.snippet.resourceId.videoId
-                ):
-                    track = await self.id_to_track(item.snippet.resourceId.videoId, "")
-                    if track:
-                        tracks.append(track)
-            return tracks
+            video_ids = [item["snippet"]["resourceId"]["videoId"] for item in items]
+
+            # Fetch the metadata in batches, then extract the streaming URLs
+            # concurrently with a cap to avoid bursts.
+            videos = await self.get_videos(video_ids)
+            semaphore = asyncio.Semaphore(MAX_CONCURRENT_LOOKUPS)
+
+            async def limited_video_to_track(video: dict) -> Optional[AudioTrack]:
+                async with semaphore:
+                    return await self.video_to_track(video, "")
+
+            results = await asyncio.gather(
+                *(limited_video_to_track(video) for video in videos),
+                return_exceptions=True,
+            )
+            return [track for track in results if isinstance(track, AudioTrack)]
         except Exception as e:
             logging.error(f"Failed to get youtube playlist '{url}': {e}")
             return []
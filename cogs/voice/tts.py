@@ -1,9 +1,14 @@
+import asyncio
+import contextlib
+import functools
+import json
 import pathlib
 import random
 import time
 from typing import TYPE_CHECKING
 
 import discord
+import xxhash
 from discord import app_commands
 from discord.ext import commands
 
@@ -12,7 +17,14 @@ from cogs.common import utils
 from cogs.common.messaging import bold, code, quoted_text
 from cogs.voice.tts_fish import generate_dialogue_audio, get_fish_voices
 from cogs.voice.tts_piper import get_piper_voices
-from cogs.voice.tts_types import Voice
+from cogs.voice.tts_types import (
+    AUDIO_SUFFIXES,
+    GENERATOR_POOL,
+    SharedAudioCache,
+    Voice,
+    VoiceRegistry,
+    save_atomically,
+)
 
 if TYPE_CHECKING:
     from bots.voicebot import VoiceBot
@@ -26,6 +38,65 @@ TTS_VOLUME = 1.0
 AUDIO_DIRECTORY = pathlib.Path("audio/tts")
 AUDIO_DIRECTORY.mkdir(parents=True, exist_ok=True)
 
+# Format TTS audio is cached in. Opus clips are a fraction of the size of MP3s, so
+# many more fit in the cache.
+AUDIO_FORMAT = "opus"
+
+# Optional list of common phrases to generate at startup, as {"voice": ["phrase"]}.
+PREWARM_FILE = pathlib.Path("tts_prewarm.json")
+
+# Once the cached audio grows past this size, the least recently used files are deleted.
+MAX_AUDIO_CACHE_BYTES = 500 * 1024 * 1024
+
+# Pruning frees space down to this size, so it isn't needed again on the next file.
+PRUNED_AUDIO_CACHE_BYTES = MAX_AUDIO_CACHE_BYTES * 9 // 10
+
+
+def audio_path(voice: Voice, text: str) -> pathlib.Path:
+    """Returns the path of the audio file for a voice speaking some text.
+
+    Files are keyed by voice and text, so repeated phrases are only generated once.
+    """
+    return voice.cache_path(AUDIO_DIRECTORY, text)
+
+
+def dialogue_audio_path(turns: "list[tuple[Voice, str]]") -> pathlib.Path:
+    """Returns the path of the audio file for a dialogue, keyed by its turns."""
+    content = "\n".join(f"{voice.name}:{line}" for voice, line in turns)
+    key = xxhash.xxh3_128_hexdigest(content.encode())
+    return AUDIO_DIRECTORY / f"dialogue-{key}.mp3"
+
+
+def prune_audio_cache(max_bytes: int = MAX_AUDIO_CACHE_BYTES) -> "tuple[int, int]":
+    """Delete the least recently used audio files until the cache fits in max_bytes.
+
+    Files are touched whenever they are reused, so their mtime is the last use.
+
+    Returns:
+        tuple[int, int]: The number of files deleted, and the cache size left in bytes
+    """
+    files = []
+    total = 0
+    for path in AUDIO_DIRECTORY.iterdir():
+        # Skip anything that isn't finished audio, like hidden .part files.
+        if path.name.startswith(".") or path.suffix not in AUDIO_SUFFIXES.values():
+            continue
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+        total += stat.st_size
+
+    removed = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        path.unlink(missing_ok=True)
+        total -= size
+        removed += 1
+    return removed, total
+
 
 class ReplayView(discord.ui.View):
     """A real Discord button attached to a TTS reply, to replay it.
@@ -50,11 +121,30 @@ class ReplayView(discord.ui.View):
 class TTS(commands.Cog):
     def __init__(self, bot: "VoiceBot"):
         self.bot = bot
-        self.voices: list[Voice] = []
+        # The loaded voices, indexed by name and category.
+        self.voices = VoiceRegistry()
         self.enable_message_handler = True  # Flag to control message handling
+        self.help_command = bot.prefix + "help"
         # Maps a reply-embed message id → the original command message, so the 🔄
         # replay button (added to the bot's reply) can re-run the original request.
         self.replay_map: dict = {}
+        # Locks held while generating an audio file, keyed by file name, so
+        # concurrent replays of the same message wait and reuse the first result.
+        self._tts_locks: dict[str, asyncio.Lock] = {}
+        # The help message only changes when the voices are reloaded, so cache it.
+        self._help_text = self._build_help_text()
+        self.prewarm_task: "asyncio.Task | None" = None
+        # Audio cache shared with other bot instances (set up on first load).
+        self.shared_cache: "SharedAudioCache | None" = None
+        # Running size of AUDIO_DIRECTORY in bytes (measured on first load).
+        self._audio_cache_bytes: "int | None" = None
+
+    async def cog_unload(self):
+        """Stop the cache warm-up and close the shared cache on unload."""
+        await self.cancel_prewarm()
+        if self.shared_cache is not None:
+            await self.shared_cache.aclose()
+            self.shared_cache = None
 
     def _remember_replay(self, response, original) -> None:
         """Record reply-embed → original command so its 🔄 can replay."""
@@ -65,6 +155,37 @@ class TTS(commands.Cog):
             for key in list(self.replay_map)[:-200]:
                 del self.replay_map[key]
 
+    @contextlib.asynccontextmanager
+    async def _generation_lock(self, cache_file: pathlib.Path):
+        """Hold the generation lock for an audio file, removing it when done."""
+        lock = self._tts_locks.setdefault(cache_file.name, asyncio.Lock())
+        try:
+            async with lock:
+                yield
+        finally:
+            if self._tts_locks.get(cache_file.name) is lock:
+                del self._tts_locks[cache_file.name]
+
+    async def prune_audio_cache(self, new_path: "pathlib.Path | None" = None):
+        """Evict old audio files in a thread once the cache is over its size limit.
+
+        A newly generated file is added to the running cache size, and the cache
+        directory is only scanned once that crosses MAX_AUDIO_CACHE_BYTES. Without
+        a new file, the cache is always scanned (and the running size corrected).
+        """
+        if new_path is not None and self._audio_cache_bytes is not None:
+            try:
+                self._audio_cache_bytes += new_path.stat().st_size
+            except FileNotFoundError:
+                pass
+            if self._audio_cache_bytes <= MAX_AUDIO_CACHE_BYTES:
+                return
+        removed, self._audio_cache_bytes = await asyncio.to_thread(
+            prune_audio_cache, PRUNED_AUDIO_CACHE_BYTES
+        )
+        if removed:
+            self.log(f"Pruned {removed} audio files from the cache")
+
     def log(self, message: str):
         """Log a message to the bot."""
         self.bot.log(f"[TTS] {message}")
@@ -73,53 +194,127 @@ class TTS(commands.Cog):
     async def reload_voices(self, interaction: discord.Interaction):
         """Reload the TTS voices."""
         start = time.time()
-        self.load_voices()
+        await self.load_voices()
         end = time.time()
         await interaction.response.send_message(
             f"Voices reloaded in {end - start:.2f} seconds ✔️"
         )
 
-    def load_voices_from_source(self, get_voices_func, source_name: str):
-        """Load voices from a source and log them.
+    async def load_voices_from_source(
+        self, get_voices_func, source_name: str
+    ) -> list[Voice]:
+        """Load voices from a source in a thread and log them.
 
         Args:
             get_voices_func: Function that returns a list of voices
             source_name: Name of the voice source for logging
         """
         self.log(f"Loading voices from {source_name}...")
-        voices = get_voices_func()
+        voices = await asyncio.to_thread(get_voices_func)
         self.log(f"Loaded {len(voices)} voices from {source_name}:")
         for voice in voices:
             self.log(f" - [{voice.category}] {voice.name} - {voice.description}")
-        self.voices.extend(voices)
         return voices
 
     @commands.Cog.listener()
     async def on_ready(self):
         """Load the voices."""
-        self.load_voices()
+        await self.load_voices()
+
+    async def load_voices(self):
+        # The sources are independent (disk, model downloads, the plomtts server),
+        # so load them concurrently.
+        sources = await asyncio.gather(
+            # Load ElevenLabs voices
+            # self.load_voices_from_source(
+            #    lambda: get_elevenlabs_voices(self.bot.secrets.get("ELEVENLABS_API_KEY")),
+            #    "ElevenLabs",
+            # ),
+            # Load Piper voices
+            self.load_voices_from_source(get_piper_voices, "Piper"),
+            # Load Fish voices
+            self.load_voices_from_source(get_fish_voices, "Fish TTS"),
+        )
+        self.voices = VoiceRegistry(voice for voices in sources for voice in voices)
 
-    def load_voices(self):
-        self.voices.clear()
-        # Load ElevenLabs voices
-        # self.load_voices_from_source(
-        #    lambda: get_elevenlabs_voices(self.bot.secrets.get("ELEVENLABS_API_KEY")),
-        #    "ElevenLabs",
-        # )
+        # Share generated audio through Redis if it's configured, and choose the
+        # format it is cached in.
+        if self.shared_cache is None:
+            self.shared_cache = self.get_shared_cache()
+        for voice in self.voices:
+            voice.shared_cache = self.shared_cache
+            voice.audio_format = AUDIO_FORMAT
+
+        self._help_text = self._build_help_text()
 
-        # Load Piper voices
-        self.load_voices_from_source(get_piper_voices, "Piper")
+        # Measure the audio cache once, then keep a running total of its size.
+        if self._audio_cache_bytes is None:
+            await self.prune_audio_cache()
 
-        # Load Fish voices
-        self.load_voices_from_source(get_fish_voices, "Fish TTS")
+        # Warm the cache for common phrases in the background, stopping any warm-up
+        # still running for the previous voices first.
+        await self.cancel_prewarm()
+        self.prewarm_task = asyncio.create_task(self.prewarm_audio())
+
+    async def cancel_prewarm(self):
+        """Cancel the background cache warm-up if it is running, and wait for it."""
+        if self.prewarm_task is None:
+            return
+        self.prewarm_task.cancel()
+        try:
+            await self.prewarm_task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.log(f"[prewarm] Failed: {e}")
+        self.prewarm_task = None
+
+    def get_shared_cache(self) -> "SharedAudioCache | None":
+        """Connect to the shared audio cache at TTS_REDIS_URL, if it is set."""
+        try:
+            url = self.bot.secrets.get("TTS_REDIS_URL")
+        except ValueError:
+            return None
+        from cogs.voice.tts_redis import RedisAudioCache
+
+        self.log("Sharing generated audio through Redis")
+        return RedisAudioCache(url)
+
+    async def prewarm_audio(self):
+        """Generate the audio for the common phrases in PREWARM_FILE, if it exists."""
+        if not PREWARM_FILE.exists():
+            return
+        try:
+            phrases_by_voice = json.loads(PREWARM_FILE.read_text())
+            if not isinstance(phrases_by_voice, dict) or not all(
+                isinstance(phrases, list)
+                and all(isinstance(phrase, str) for phrase in phrases)
+                for phrases in phrases_by_voice.values()
+            ):
+                raise ValueError('expected {"voice": ["phrase", ...]}')
+        except (OSError, ValueError) as e:
+            self.log(f"Failed to read {PREWARM_FILE}: {e}")
+            return
+
+        for voice_name, phrases in phrases_by_voice.items():
+            voice = self.get_voice_by_name(voice_name)
+            if voice is None:
+                self.log(f"[prewarm] Voice not found: {voice_name}")
+                continue
+            cached = sum(audio_path(voice, phrase).exists() for phrase in phrases)
+            try:
+                await voice.prewarm(phrases, AUDIO_DIRECTORY)
+            except Exception as e:
+                self.log(f"[prewarm] [{voice.name}] Error generating audio: {e}")
+                continue
+            self.log(
+                f"[prewarm] [{voice.name}] {cached}/{len(phrases)} phrases were cached"
+            )
+        await self.prune_audio_cache()
 
     def get_voice_by_name(self, name: str) -> Voice | None:
         """Get a voice by name, case insensitive."""
-        name = name.lower()
-        for voice in self.voices:
-            if voice.name.lower() == name:
-                return voice
-        return None
+        return self.voices.by_name(name)
 
     def get_voice_and_text(self, message) -> "tuple[Voice, str]":
         """Get the voice for a message and return the cleaned text with voice name removed.
@@ -135,42 +330,20 @@ class TTS(commands.Cog):
 
         if not words:
             # No text at all, return random voice and empty text
-            voice = random.Random(message.id).choice(list(self.voices))
+            voice = random.Random(message.id).choice(self.voices)
             return voice, ""
 
-        # Try matching with increasing number of words (up to the full voice name length)
-        best_match = None
-        best_words_matched = 0
-
-        for voice in self.voices:
-            voice_words = voice.name.lower().split()
-
-            # Try matching from 1 word up to the length of the voice name or available words
-            max_words_to_try = min(len(voice_words), len(words))
-
-            for num_words in range(1, max_words_to_try + 1):
-                user_phrase = " ".join(words[:num_words]).lower()
-
-                # Check if this phrase matches any part of the voice name
-                if any(
-                    user_phrase in " ".join(voice_words[i : i + num_words])
-                    for i in range(len(voice_words) - num_words + 1)
-                ):
-                    # Prefer longer matches
-                    if num_words > best_words_matched:
-                        best_match = voice
-                        best_words_matched = num_words
-
-        # If we found a match with at least 3 characters, use it and strip the matched words
-        if best_match and len("".join(words[:best_words_matched])) >= 3:
-            if len(words) > best_words_matched:
-                cleaned_text = " ".join(words[best_words_matched:]).strip()
-            else:
-                cleaned_text = ""  # All words were part of the voice name
-            return best_match, cleaned_text
+        # Try the longest phrase first, so the voice matching the most words wins.
+        words_lower = [word.lower() for word in words]
+        for num_words in range(min(self.voices.max_name_words, len(words)), 0, -1):
+            user_phrase = " ".join(words_lower[:num_words])
+            voice = self.voices.by_phrase(user_phrase)
+            if voice is not None:
+                cleaned_text = " ".join(words[num_words:]).strip()
+                return voice, cleaned_text
 
         # No match found, return random voice and original text
-        voice = random.Random(message.id).choice(list(self.voices))
+        voice = random.Random(message.id).choice(self.voices)
         return voice, content_without_prefix
 
     def _match_voice_by_name(self, name: str) -> "Voice | None":
@@ -178,13 +351,7 @@ class TTS(commands.Cog):
         name_l = name.strip().lower()
         if len(name_l) < 3:
             return None
-        for voice in self.voices:  # exact match wins
-            if voice.name.lower() == name_l:
-                return voice
-        for voice in self.voices:  # else first name containing the phrase
-            if name_l in voice.name.lower():
-                return voice
-        return None
+        return self.voices.search(name_l)
 
     def parse_dialogue(
         self, content_without_prefix: str, seed=0
@@ -216,7 +383,7 @@ class TTS(commands.Cog):
                 continue
             if voice is None:
                 # No (recognized) name → random voice, deterministic per turn for replay.
-                voice = random.Random(f"{seed}-{i}").choice(list(self.voices))
+                voice = random.Random(f"{seed}-{i}").choice(self.voices)
             turns.append((voice, line))
 
         if not any_named or len(turns) < 2:
@@ -240,20 +407,24 @@ class TTS(commands.Cog):
             return
 
         # Set the audio path
-        mp3_path = AUDIO_DIRECTORY / f"{int(time.time())}.mp3"
+        cache_file = audio_path(voice, text)
 
         # Generate and save the audio
         try:
-            if not mp3_path.exists():
-                self.log(f"[{voice.name}] Generating TTS audio: {mp3_path}")
-                voice.save_audio(text, mp3_path)
+            async with self._generation_lock(cache_file):
+                if not cache_file.exists():
+                    self.log(f"[{voice.name}] Generating TTS audio: {cache_file}")
+                    await voice.save_audio(text, cache_file)
+                    await self.prune_audio_cache(cache_file)
+                else:
+                    cache_file.touch()  # Mark as recently used.
         except Exception as e:
             self.log(f"Error generating audio: {e}")
             return
 
         # Play the audio
         try:
-            track = AudioTrack(name=mp3_path.stem, path=mp3_path)
+            track = AudioTrack(name=cache_file.stem, path=cache_file)
             await self.bot.audio.play(voice_channel, track)
         except Exception as e:
             self.log(f"Error playing audio: {e}")
@@ -265,14 +436,17 @@ class TTS(commands.Cog):
         if not self.enable_message_handler:
             return
 
+        # Most messages aren't for the bot, so check the prefix first.
+        if not message.content.startswith(self.bot.prefix):
+            return
+
         # Help message.
-        if message.content.startswith(self.bot.prefix + "help"):
+        if message.content.startswith(self.help_command):
             await self.send_help(message.channel)
             return
 
         # Play TTS messages that start with the prefix.
-        if message.content.startswith(self.bot.prefix):
-            await self.handle_message_tts(message, message.author)
+        await self.handle_message_tts(message, message.author)
 
     @commands.Cog.listener()
     @utils.ignore_self
@@ -289,9 +463,14 @@ class TTS(commands.Cog):
 
     async def send_help(self, channel):
         """Send the help message to the channel."""
-        categories = set(voice.category for voice in self.voices)
+        await self.bot.messaging.send_embed(
+            channel, text=self._help_text, color=discord.Color.dark_purple()
+        )
+
+    def _build_help_text(self) -> str:
+        """Build the help message text for the loaded voices."""
         line = "-----------\n"
-        text = (
+        header = (
             f"Usage: `{self.bot.prefix}[text]` or `{self.bot.prefix}[voice] [text]`\n\n"
             f"{bold('Voice effects')} — drop tags in `[brackets]` anywhere in your text to "
             "control emotion, tone, and prosody (powered by Fish Audio S2):\n"
@@ -304,18 +483,16 @@ class TTS(commands.Cog):
             "`Voice: line | Voice: line` (up to 5 voices, one natural conversation):\n"
             f"`{self.bot.prefix}Kratos: Boy! | Sam: [laugh] Hi there | Kratos: bye`\n\n"
         )
-        for category in sorted(categories):
-            text += f"{bold(category)} voices:\n"
-            for voice in sorted(self.voices, key=lambda v: v.name):
-                if voice.category == category:
-                    text += f" {code(voice.name)}"
-            text += "\n"
-            text += line
-
-        text = text[: -len(line)]  # Remove the last line break.
-        await self.bot.messaging.send_embed(
-            channel, text=text, color=discord.Color.dark_purple()
-        )
+        sections = []
+        for category in sorted(self.voices.category_names()):
+            voices = sorted(self.voices.in_category(category), key=lambda v: v.name)
+            parts = [f"{bold(category)} voices:\n"]
+            parts.extend(f" {code(voice.name)}" for voice in voices)
+            parts.append("\n")
+            sections.append("".join(parts))
+
+        # Separate categories with a line break (none after the last one).
+        return header + line.join(sections)
 
     async def handle_message_tts(self, message: discord.Message, user):
         """Processes a TTS message. May be triggered by on_message() or on_reaction()
@@ -350,19 +527,21 @@ class TTS(commands.Cog):
             voice, text = self.get_voice_and_text(message)
 
             # Set the audio path.
-            mp3_path = AUDIO_DIRECTORY / f"{message.id}.mp3"
+            cache_file = audio_path(voice, text)
+            already_cached = cache_file.exists()
 
             # Build the footer text
             # 🗨️ plomdawg 🔁 plomdawg 💰 $0 ⌚ 7.75 seconds
             footer_parts = [f"🗨️ {message.author.name}"]
 
-            # Add replay info if applicable
-            if user != message.author or mp3_path.exists():
+            # Add replay info if applicable (the audio may also be cached from
+            # someone else's message, which isn't a replay)
+            if user != message.author:
                 footer_parts.append(f"🔁 {user.name}")
 
             # Add cost info
             cost_text = "💰 "
-            if mp3_path.exists():
+            if already_cached or voice.is_free:
                 cost_text += "$0"
             else:
                 cost_text += f"{voice.calculate_cost(text)}"
@@ -395,9 +574,13 @@ class TTS(commands.Cog):
             # Generate and save the audio
             start_time = time.time()
             try:
-                if not mp3_path.exists():
-                    self.log(f"[{voice.name}] Generating TTS audio: {mp3_path}")
-                    voice.save_audio(text, mp3_path)
+                async with self._generation_lock(cache_file):
+                    if not cache_file.exists():
+                        self.log(f"[{voice.name}] Generating TTS audio: {cache_file}")
+                        await voice.save_audio(text, cache_file)
+                        await self.prune_audio_cache(cache_file)
+                    else:
+                        cache_file.touch()  # Mark as recently used.
             except Exception as e:
                 return await self.fail(message, str(e))
 
@@ -413,7 +596,9 @@ class TTS(commands.Cog):
                 )
 
                 # Play the audio (full volume — louder than the music default)
-                track = AudioTrack(name=mp3_path.stem, path=mp3_path, volume=TTS_VOLUME)
+                track = AudioTrack(
+                    name=cache_file.stem, path=cache_file, volume=TTS_VOLUME
+                )
                 await self.bot.audio.play(user.voice.channel, track)
 
                 # Update embed to show success
@@ -437,14 +622,14 @@ class TTS(commands.Cog):
             )
 
         try:
-            mp3_path = AUDIO_DIRECTORY / f"{message.id}.mp3"
+            cache_file = dialogue_audio_path(turns)
 
             # Embed body: one line per turn; title lists the distinct speakers.
             body = "\n".join(f"{bold(voice.name)}: {line}" for voice, line in turns)
             speakers = ", ".join(dict.fromkeys(voice.name for voice, _ in turns))
 
             footer_parts = [f"🗨️ {message.author.name}"]
-            if user != message.author or mp3_path.exists():
+            if user != message.author:
                 footer_parts.append(f"🔁 {user.name}")
             footer_parts.append("💰 $0")
             footer = " ".join(footer_parts)
@@ -469,11 +654,21 @@ class TTS(commands.Cog):
             # Generate the dialogue audio
             start_time = time.time()
             try:
-                if not mp3_path.exists():
-                    self.log(f"[dialogue] Generating {len(turns)} turns: {mp3_path}")
-                    generate_dialogue_audio(
-                        [(voice.name, line) for voice, line in turns], mp3_path
-                    )
+                async with self._generation_lock(cache_file):
+                    if not cache_file.exists():
+                        self.log(
+                            f"[dialogue] Generating {len(turns)} turns: {cache_file}"
+                        )
+                        save = functools.partial(
+                            generate_dialogue_audio,
+                            [(voice.name, line) for voice, line in turns],
+                        )
+                        await asyncio.get_running_loop().run_in_executor(
+                            GENERATOR_POOL, save_atomically, cache_file, save
+                        )
+                        await self.prune_audio_cache(cache_file)
+                    else:
+                        cache_file.touch()  # Mark as recently used.
             except Exception as e:
                 return await self.fail(message, str(e))
 
@@ -484,7 +679,9 @@ class TTS(commands.Cog):
                 await self.bot.messaging.edit_embed(
                     message=response, color=discord.Color.blue(), footer=footer
                 )
-                track = AudioTrack(name=mp3_path.stem, path=mp3_path, volume=TTS_VOLUME)
+                track = AudioTrack(
+                    name=cache_file.stem, path=cache_file, volume=TTS_VOLUME
+                )
                 await self.bot.audio.play(user.voice.channel, track)
                 await self.bot.messaging.edit_embed(
                     message=response, color=discord.Color.green()
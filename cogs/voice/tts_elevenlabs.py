@@ -1,7 +1,7 @@
 """ElevenLabs implementation of the TTS generator."""
 
 import pathlib
-from typing import List
+from typing import Iterator, List
 
 from elevenlabs.client import ElevenLabs
 
@@ -17,6 +17,15 @@ NAMES = {
     "Sexy Female Villain Voice": "Sexy",
 }
 
+# Starter tier gives 40,000 characters per month for $5 ($0.000125 per character).
+COST_MICROS_PER_CHARACTER = 5_000_000 // 40_000
+
+# Buffer size used when writing streamed audio to disk.
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# ElevenLabs output format for each audio format (Ogg Opus at the cache's bitrate).
+OUTPUT_FORMATS = {"mp3": "mp3_44100_128", "opus": "opus_48000_32"}
+
 
 class ElevenLabsGenerator(TTSGenerator):
     """ElevenLabs implementation of the TTS generator."""
@@ -25,40 +34,55 @@ class ElevenLabsGenerator(TTSGenerator):
         self.client = client
         self.voice_id = voice_id
 
-    def save_audio(self, text: str, path: pathlib.Path) -> pathlib.Path:
+    def save_audio(
+        self, text: str, path: pathlib.Path, audio_format: str = "mp3"
+    ) -> pathlib.Path:
         """Generate audio bytes from text using the specified voice.
 
         Args:
             text: The text to convert to speech
             path: The path to save the audio file
+            audio_format: The format to save the audio in (see AUDIO_SUFFIXES)
 
         Returns:
             pathlib.Path: The path to the saved audio file
         """
-        audio_iterator = self.client.text_to_speech.convert(
+        # Save the audio to the path as it arrives, buffering the small chunks
+        # into fewer writes.
+        with open(path, "wb", buffering=WRITE_BUFFER_SIZE) as f:
+            for chunk in self.stream_audio(text, audio_format):
+                f.write(chunk)
+        return path
+
+    def stream_audio(self, text: str, audio_format: str = "mp3") -> Iterator[bytes]:
+        """Generate audio from text, yielding chunks as they are generated.
+
+        Uses the streaming endpoint so audio is sent while it is still being
+        generated, and the first chunk arrives long before the whole clip is done.
+
+        Args:
+            text: The text to convert to speech
+            audio_format: The format to generate the audio in (see AUDIO_SUFFIXES)
+
+        Returns:
+            Iterator[bytes]: The audio, in chunks
+        """
+        return self.client.text_to_speech.stream(
             text=text,
             voice_id=self.voice_id,
-            output_format="mp3_44100_128",
+            output_format=OUTPUT_FORMATS[audio_format],
         )
-        # Save the audio to the path.
-        with open(path, "wb") as f:
-            for chunk in audio_iterator:
-                f.write(chunk)
-        return path
 
-    def calculate_cost(self, text: str) -> str:
+    def cost_micros(self, text: str) -> int:
         """Calculate the cost of generating this TTS message.
 
         Args:
             text: The text to calculate cost for
 
         Returns:
-            str: Formatted cost string
+            int: The cost in millionths of a dollar
         """
-        # Starter tier gives 40,000 characters per month for $5
-        cost_per_character = 5 / 40000
-        cost = round(len(text) * cost_per_character, 8)
-        return f"${cost}"
+        return len(text) * COST_MICROS_PER_CHARACTER
 
 
 def get_elevenlabs_voices(api_key: str) -> List[Voice]:
@@ -78,6 +102,7 @@ def get_elevenlabs_voices(api_key: str) -> List[Voice]:
                 category=category,
                 avatar=AVATARS.get(name, ""),
                 generator=ElevenLabsGenerator(client, voice.voice_id),
+                cost_micros_per_char=COST_MICROS_PER_CHARACTER,
             )
         )
     return voices
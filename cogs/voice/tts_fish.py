@@ -1,25 +1,78 @@
+import functools
 import pathlib
+import subprocess
 from typing import List
 from urllib.parse import quote
 
 from plomtts import TTSClient
-from pydub import AudioSegment, effects
 
-from cogs.voice.tts_types import TTSGenerator, Voice
+from cogs.voice.tts_types import FFMPEG_OUTPUT_ARGS, TTSGenerator, Voice
 
 PLOMTTS_ENDPOINT = "http://192.168.8.175:8420"
 
+# EBU R128 loudness normalization applied to generated speech
+LOUDNORM_FILTER = "loudnorm=I=-16:TP=-1.5:LRA=11"
 
-def _boost_file(path: pathlib.Path) -> None:
-    """Normalize an mp3 to peak 0 dBFS in place (Fish Audio S2 output is quiet).
+# Volume of a voice's backing track relative to the speech.
+BACKING_GAIN = "-10dB"
+
+# Output sample rate for each audio format (Opus only supports up to 48 kHz).
+SAMPLE_RATES = {"mp3": "44100", "opus": "48000"}
+
+
+@functools.lru_cache(maxsize=4)
+def get_client(endpoint: str = PLOMTTS_ENDPOINT) -> TTSClient:
+    """Get the plomtts client for an endpoint, reusing its HTTP connection."""
+    return TTSClient(endpoint)
+
+
+def _boost_file(
+    path: pathlib.Path,
+    backing_path: pathlib.Path | None = None,
+    audio_format: str = "mp3",
+) -> None:
+    """Loudness-normalize an mp3 in place (Fish Audio S2 output is quiet).
 
     The player plays TTS tracks at full volume (see TTS_VOLUME), so normalizing
-    the file to the ceiling makes speech as loud as possible without clipping.
+    the file makes speech loud without clipping. If a backing track is given, it is
+    looped to the speech length, lowered by BACKING_GAIN and mixed in by the same
+    ffmpeg pass, rather than decoding both files into pydub. The same pass encodes
+    the result in audio_format, so it never needs re-encoding afterwards.
     """
+    boosted_path = path.with_name(f"{path.stem}.boosted{path.suffix}")
+    if backing_path is None:
+        inputs = ["-i", str(path)]
+        filters = ["-af", LOUDNORM_FILTER]
+    else:
+        inputs = ["-i", str(path), "-stream_loop", "-1", "-i", str(backing_path)]
+        filters = [
+            "-filter_complex",
+            f"[1:a]volume={BACKING_GAIN}[backing];"
+            "[0:a][backing]amix=inputs=2:duration=first:normalize=0,"
+            f"{LOUDNORM_FILTER}",
+        ]
     try:
-        audio = AudioSegment.from_file(str(path))
-        effects.normalize(audio).export(str(path), format="mp3")
+        subprocess.run(
+            [
+                "ffmpeg",
+                "-y",
+                "-loglevel",
+                "error",
+                *inputs,
+                *filters,
+                "-ar",
+                SAMPLE_RATES[audio_format],
+                *FFMPEG_OUTPUT_ARGS[audio_format],
+                str(boosted_path),
+            ],
+            check=True,
+        )
+        boosted_path.replace(path)
     except Exception as e:  # pragma: no cover - best-effort loudness
+        boosted_path.unlink(missing_ok=True)
+        # The generated mp3 is only a usable fallback if mp3 was asked for.
+        if audio_format != "mp3":
+            raise
         print(f"Warning: volume normalize failed: {e}")
 
 
@@ -30,7 +83,7 @@ def generate_dialogue_audio(turns: list, path: pathlib.Path) -> None:
         turns: ordered list of (voice_id, text) tuples.
         path: output mp3 path.
     """
-    client = TTSClient(PLOMTTS_ENDPOINT)
+    client = get_client()
     print(f"Generating dialogue with {len(turns)} turns")
     audio_bytes = client.generate_dialogue(turns=turns)
     path.write_bytes(audio_bytes)
@@ -46,9 +99,9 @@ class FishSpeechGenerator(TTSGenerator):
         self.name = name
         self.backing_audio_mp3 = pathlib.Path("models") / name / "backing.mp3"
 
-    def save_audio(self, text: str, path: pathlib.Path):
-        """Save the audio to a path."""
-        client = TTSClient(PLOMTTS_ENDPOINT)
+    def save_audio(self, text: str, path: pathlib.Path, audio_format: str = "mp3"):
+        """Save the audio to a path, in audio_format (see AUDIO_SUFFIXES)."""
+        client = get_client()
 
         print(f"Generating audio for {text!r} using voice {self.name!r}")
         audio_bytes = client.generate_speech(text=text, voice_id=self.name)
@@ -56,38 +109,22 @@ class FishSpeechGenerator(TTSGenerator):
         path.write_bytes(audio_bytes)
         print(f"Saved audio to {path}")
 
-        # Special case: some voices have a backing mp3 track to mix in.
+        # Boost loudness for Discord playback. Some voices have a backing mp3 track
+        # to mix in as well.
         if self.backing_audio_mp3.exists():
-            try:
-                generated_audio = AudioSegment.from_file(str(path))
-                backing_audio = AudioSegment.from_mp3(str(self.backing_audio_mp3))
-
-                generated_length = len(generated_audio)
-                if len(backing_audio) > generated_length:
-                    backing_audio = backing_audio[:generated_length]
-                elif len(backing_audio) < generated_length:
-                    loops_needed = (generated_length // len(backing_audio)) + 1
-                    backing_audio = backing_audio * loops_needed
-                    backing_audio = backing_audio[:generated_length]
-
-                backing_audio = backing_audio - 10  # Reduce by 10dB
-                mixed_audio = generated_audio.overlay(backing_audio)
-                mixed_audio.export(str(path), format="mp3")
-                print(f"Mixed audio with backing track to {path}")
-            except Exception as e:
-                print(f"Warning: Failed to mix backing track: {e}")
-
-        # Boost loudness for Discord playback.
-        _boost_file(path)
-
-    def calculate_cost(self, text: str) -> str:
+            _boost_file(path, self.backing_audio_mp3, audio_format)
+            print(f"Mixed audio with backing track to {path}")
+        else:
+            _boost_file(path, audio_format=audio_format)
+
+    def cost_micros(self, text: str) -> int:
         """Calculate the cost of generating this TTS message."""
-        return "$0"  # local TTS generation
+        return 0  # local TTS generation
 
 
 def get_fish_voices() -> List[Voice]:
     """Get the voices from the plomtts server."""
-    client = TTSClient(PLOMTTS_ENDPOINT)
+    client = get_client()
     voice_list = client.list_voices()
     return [
         Voice(
@@ -97,6 +134,7 @@ def get_fish_voices() -> List[Voice]:
             avatar=(
                 PLOMTTS_ENDPOINT + quote(v.avatar_url) if v.avatar_url else ""
             ),
+            is_free=True,
         )
         for v in voice_list.voices
     ]
@@ -1,13 +1,29 @@
 """Piper TTS implementation of the TTS generator."""
 
+import functools
+import io
 import pathlib
+import shutil
+import subprocess
 import wave
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
 
 import requests
 from piper import PiperVoice
+from requests.adapters import HTTPAdapter
 
-from cogs.voice.tts_types import TTSGenerator, Voice
+from cogs.voice.tts_types import FFMPEG_OUTPUT_ARGS, TTSGenerator, Voice
+
+# Block size used when downloading voice models.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Ask for model files uncompressed, so the size written matches Content-Length.
+DOWNLOAD_HEADERS = {"Accept-Encoding": "identity"}
+
+# Shared session so all model downloads reuse the same connections.
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
 
 # Voice configurations
 VOICES = [
@@ -39,6 +55,12 @@ VOICES = [
 ]
 
 
+@functools.lru_cache(maxsize=None)
+def load_piper_voice(voice_path: str, config_path: str) -> PiperVoice:
+    """Load a Piper voice model, sharing one instance per model file."""
+    return PiperVoice.load(voice_path, config_path)
+
+
 class PiperGenerator(TTSGenerator):
     """Piper implementation of the TTS generator."""
 
@@ -51,49 +73,65 @@ class PiperGenerator(TTSGenerator):
         """
         self.voice_path = voice_path
         self.config_path = config_path
-        self._voice = None
 
     @property
     def voice(self) -> PiperVoice:
-        """Lazy load the voice model when needed."""
-        if self._voice is None:
-            self._voice = PiperVoice.load(self.voice_path, self.config_path)
-        return self._voice
+        """Lazy load the voice model when needed (shared across reloads)."""
+        return load_piper_voice(self.voice_path, self.config_path)
 
-    def save_audio(self, text: str, path: pathlib.Path) -> pathlib.Path:
+    def save_audio(
+        self, text: str, path: pathlib.Path, audio_format: str = "mp3"
+    ) -> pathlib.Path:
         """Generate audio bytes from text using the specified voice.
 
         Args:
             text: The text to convert to speech
             path: The path to save the audio file
+            audio_format: The format to save the audio in (see AUDIO_SUFFIXES)
 
         Returns:
             pathlib.Path: The path to the saved audio file
         """
-        # Generate audio using Piper
-        wav_path = path.with_suffix(".wav")
-        with wave.open(str(wav_path), "wb") as wav_file:
+        # Generate audio using Piper into an in-memory WAV
+        wav_buffer = io.BytesIO()
+        with wave.open(wav_buffer, "wb") as wav_file:
             self.voice.synthesize(text, wav_file)
 
-        # Convert WAV to MP3 using pydub
-        from pydub import AudioSegment
-
-        audio = AudioSegment.from_wav(str(wav_path))
-        audio.export(str(path), format="mp3")
-
-        # Clean up the temporary WAV file
-        wav_path.unlink()
+        # Encode the WAV to the cache format with a single ffmpeg pass, piped
+        # through stdin
+        subprocess.run(
+            [
+                "ffmpeg",
+                "-y",
+                "-loglevel",
+                "error",
+                "-f",
+                "wav",
+                "-i",
+                "pipe:0",
+                *FFMPEG_OUTPUT_ARGS[audio_format],
+                str(path),
+            ],
+            input=wav_buffer.getvalue(),
+            check=True,
+        )
 
         return path
 
-    def calculate_cost(self, text: str) -> str:
+    def cost_micros(self, text: str) -> int:
         """Calculate the cost of generating this TTS message."""
-        return "$0"  # local TTS generation
+        return 0  # local TTS generation
 
 
 def download_file(url: str, path: pathlib.Path) -> bool:
     """Download a file to a path.
 
+    The file is downloaded to a .part file next to the path, which is only renamed
+    once its size matches the server's Content-Length. An interrupted download
+    keeps its .part file and resumes from where it stopped on the next attempt. If
+    the size is unknown (or the HEAD request fails), the whole file is downloaded
+    again without checking its size.
+
     Args:
         url: URL to download from
         path: Path to save the file to
@@ -101,17 +139,46 @@ def download_file(url: str, path: pathlib.Path) -> bool:
     Returns:
         bool: True if download was successful
     """
+    part_path = path.with_name(f"{path.name}.part")
     try:
-        response = requests.get(url, stream=True)
-        response.raise_for_status()
-
-        with open(path, "wb") as f:
-            for data in response.iter_content(8192):
-                f.write(data)
+        # Get the expected size (0 if the server doesn't say).
+        try:
+            head = session.head(url, allow_redirects=True, headers=DOWNLOAD_HEADERS)
+            head.raise_for_status()
+            expected_size = int(head.headers.get("Content-Length", 0))
+        except requests.RequestException as e:
+            print(f"Warning: failed to get the size of {url}: {e}")
+            expected_size = 0
+
+        # Resume a partial download, or start over if it is somehow too large (or
+        # there is no size to check it against).
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        if not expected_size or offset > expected_size:
+            offset = 0
+
+        if not expected_size or offset < expected_size:
+            headers = dict(DOWNLOAD_HEADERS)
+            if offset:
+                headers["Range"] = f"bytes={offset}-"
+            with session.get(url, stream=True, headers=headers) as response:
+                response.raise_for_status()
+
+                # Servers that ignore the range send the whole file again.
+                mode = "ab" if response.status_code == 206 else "wb"
+
+                # Copy straight from the socket in large blocks.
+                response.raw.decode_content = True
+                with open(part_path, mode) as f:
+                    shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
+
+        if expected_size and part_path.stat().st_size != expected_size:
+            print(f"Warning: incomplete download of {url}, will resume next time")
+            return False
+
+        part_path.replace(path)
         return True
     except Exception as e:
-        if path.exists():
-            path.unlink()
+        print(f"Warning: failed to download {url}: {e}")
         return False
 
 
@@ -124,6 +191,7 @@ def get_piper_voices() -> List[Voice]:
     models_dir.mkdir(parents=True, exist_ok=True)
 
     # Download all voices if not present
+    downloads = []
     for voice_config in VOICES:
         name = voice_config.get("name", "").lower()
         language = voice_config.get("language", "")
@@ -131,14 +199,15 @@ def get_piper_voices() -> List[Voice]:
         voice_path = models_dir / f"{name}-{language}-{quality}.onnx"
         config_path = models_dir / f"{name}-{language}-{quality}.onnx.json"
 
-        if not voice_path.exists() or not config_path.exists():
-            # Download from Piper's model repository with correct version and download parameters
-            # https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/en/en_US/lessac/medium/en_US-lessac-medium.onnx
-            #
-            # https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/en/en_US/lessac/medium/en_US-lessac-medium.json
-            base_url = f"https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/{language.split('_')[0]}/{language}/{name}/{quality}/{language}-{name}-{quality}"
-            download_file(f"{base_url}.onnx?download=true", voice_path)
-            download_file(f"{base_url}.onnx.json?download=true", config_path)
+        # Download from Piper's model repository with correct version and download parameters
+        # https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/en/en_US/lessac/medium/en_US-lessac-medium.onnx
+        #
+        # https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/en/en_US/lessac/medium/en_US-lessac-medium.json
+        base_url = f"https://huggingface.co/rhasspy/piper-voices/resolve/v1.0.0/{language.split('_')[0]}/{language}/{name}/{quality}/{language}-{name}-{quality}"
+        if not voice_path.exists():
+            downloads.append((f"{base_url}.onnx?download=true", voice_path))
+        if not config_path.exists():
+            downloads.append((f"{base_url}.onnx.json?download=true", config_path))
 
         voice_name = voice_config.get("alias", voice_config.get("name", ""))
         voices.append(
@@ -148,7 +217,13 @@ def get_piper_voices() -> List[Voice]:
                 category=voice_config.get("category", ""),
                 avatar=voice_config.get("avatar", ""),
                 generator=PiperGenerator(str(voice_path), str(config_path)),
+                is_free=True,
             )
         )
 
+    # Fetch any missing model files concurrently rather than one after another.
+    if downloads:
+        with ThreadPoolExecutor(max_workers=len(downloads)) as executor:
+            list(executor.map(lambda args: download_file(*args), downloads))
+
     return voices
@@ -0,0 +1,31 @@
+"""Redis-backed shared cache for generated TTS audio."""
+
+import redis.asyncio as redis
+
+# Prefix for the audio keys, so the cache can share a Redis database.
+KEY_PREFIX = "tts:"
+
+
+class RedisAudioCache:
+    """Shares generated audio between bot instances through Redis."""
+
+    def __init__(self, url: str):
+        """Initialize the cache.
+
+        Args:
+            url: The Redis URL, e.g. redis://localhost:6379/0
+        """
+        # The client keeps a connection pool, so it is created once and reused.
+        self.client = redis.from_url(url)
+
+    async def get(self, key: str) -> bytes | None:
+        """Get the audio for a cache key, or None if it isn't cached."""
+        return await self.client.get(KEY_PREFIX + key)
+
+    async def set(self, key: str, data: bytes, ttl: int) -> None:
+        """Cache the audio for a cache key for ttl seconds."""
+        await self.client.set(KEY_PREFIX + key, data, ex=ttl)
+
+    async def aclose(self) -> None:
+        """Close the client and its connection pool."""
+        await self.client.aclose()
@@ -1,37 +1,197 @@
+import asyncio
+import functools
+import os
 import pathlib
-from typing import Protocol
+import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Protocol, Sequence
+
+import xxhash
+
+# Threads that run the blocking TTS generators. Bounded so a burst of requests
+# queues up instead of spawning a thread (and an API call or model run) each.
+GENERATOR_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tts")
+
+# How long generated audio is kept in a shared cache (in seconds).
+SHARED_CACHE_TTL = 24 * 60 * 60
+
+# File suffix of the cached audio in each supported format.
+AUDIO_SUFFIXES = {"mp3": ".mp3", "opus": ".ogg"}
+
+# Opus bitrate for cached speech (a fraction of the size of the same speech as MP3).
+OPUS_BITRATE = "32k"
+
+# ffmpeg output options that encode audio in each supported format.
+FFMPEG_OUTPUT_ARGS = {
+    "mp3": ["-f", "mp3"],
+    "opus": ["-c:a", "libopus", "-b:a", OPUS_BITRATE, "-f", "ogg"],
+}
+
+# The number of cost strings remembered per voice.
+COST_CACHE_SIZE = 1024
+
+
+def get_part_path(path: pathlib.Path) -> pathlib.Path:
+    """Returns a temporary path for writing path before it is moved into place.
+
+    The name is unique per call, so concurrent writers of the same path (e.g. an old
+    and a new Voice after a reload) never share a temporary file.
+    """
+    return path.with_name(f".{path.name}.{os.getpid()}.{uuid.uuid4().hex}.part")
+
+
+def save_atomically(path: pathlib.Path, save: Callable[[pathlib.Path], object]):
+    """Call save() with a temporary path, then move the file into place.
+
+    A crash or error mid-generation leaves no truncated file at path, so a file
+    that exists there is always complete and safe to serve from the cache.
+    """
+    part_path = get_part_path(path)
+    try:
+        save(part_path)
+        os.replace(part_path, path)
+    except BaseException:
+        part_path.unlink(missing_ok=True)
+        raise
+    return path
+
+
+def save_batch_atomically(
+    generator: "TTSGenerator",
+    items: "list[tuple[str, pathlib.Path]]",
+    audio_format: str = "mp3",
+) -> None:
+    """Like save_atomically, for a batch of (text, path) items from one generator."""
+    part_items = []
+    try:
+        for text, path in items:
+            part_items.append((text, get_part_path(path)))
+        generator.save_audio_batch(part_items, audio_format)
+        for (_, part_path), (_, path) in zip(part_items, items):
+            os.replace(part_path, path)
+    finally:
+        for _, part_path in part_items:
+            part_path.unlink(missing_ok=True)
+
+
+async def _wait_for_batch(batch: asyncio.Future, path: pathlib.Path) -> pathlib.Path:
+    """Wait for a save_batch_atomically call to finish, then return one of its paths."""
+    # Shielded so one waiter being cancelled doesn't cancel the batch for the rest.
+    await asyncio.shield(batch)
+    return path
+
+
+def format_cost(micros: int) -> str:
+    """Format a cost in millionths of a dollar, e.g. 1250 -> "$0.00125", 0 -> "$0"."""
+    return "$" + f"{micros / 1_000_000:.6f}".rstrip("0").rstrip(".")
 
 
 class TTSGenerator(Protocol):
     """Protocol defining the interface for a TTS generator."""
 
-    def calculate_cost(self, text: str) -> str:
+    def cost_micros(self, text: str) -> int:
         """Calculate the cost of generating this TTS message.
 
         Args:
             text: The text to calculate cost for
 
         Returns:
-            str: Formatted cost string like "$0.001"
+            int: The cost in millionths of a dollar, e.g. 1000 for $0.001
         """
         ...
 
-    def save_audio(self, text: str, path: pathlib.Path) -> pathlib.Path:
+    def save_audio(
+        self, text: str, path: pathlib.Path, audio_format: str = "mp3"
+    ) -> pathlib.Path:
         """Generate audio bytes from text using the specified voice.
 
         Args:
             text: The text to convert to speech
             path: The path to save the audio file
+            audio_format: The format to save the audio in (see AUDIO_SUFFIXES)
 
         Returns:
             pathlib.Path: The path to the saved audio file
         """
         ...
 
+    def save_audio_batch(
+        self, items: "list[tuple[str, pathlib.Path]]", audio_format: str = "mp3"
+    ) -> "list[pathlib.Path]":
+        """Generate several audio files, one per (text, path) item.
+
+        Generates them one at a time by default. Generators for providers with a
+        batch endpoint can override this to make a single request.
+
+        Args:
+            items: The texts to convert to speech and the paths to save them to
+            audio_format: The format to save the audio in (see AUDIO_SUFFIXES)
+
+        Returns:
+            list[pathlib.Path]: The paths to the saved audio files
+        """
+        return [self.save_audio(text, path, audio_format) for text, path in items]
+
+
+def name_phrases(name: str) -> "set[str]":
+    """Returns every phrase a user can type to select a voice by name.
+
+    A phrase of n words matches if it is a substring of n consecutive words in the
+    (lowercased) voice name, so it runs from the tail of one name word to the head
+    of another. Phrases shorter than 3 characters (ignoring spaces) are too vague.
+    """
+    name_words = name.lower().split()
+    phrases = set()
+    for i, first in enumerate(name_words):
+        # Single words: any substring of the word.
+        for start in range(len(first)):
+            for end in range(start + 1, len(first) + 1):
+                phrases.add(first[start:end])
+        # Multiple words: a suffix of the first word, the middle words, and a prefix
+        # of the last word.
+        for j in range(i + 1, len(name_words)):
+            middle = name_words[i + 1 : j]
+            last = name_words[j]
+            for start in range(len(first)):
+                for end in range(1, len(last) + 1):
+                    phrases.add(" ".join([first[start:], *middle, last[:end]]))
+    return {phrase for phrase in phrases if len(phrase.replace(" ", "")) >= 3}
+
+
+class SharedAudioCache(Protocol):
+    """Protocol for a cache of generated audio shared between bot instances."""
+
+    async def get(self, key: str) -> bytes | None:
+        """Get the audio for a cache key, or None if it isn't cached."""
+        ...
+
+    async def set(self, key: str, data: bytes, ttl: int) -> None:
+        """Cache the audio for a cache key for ttl seconds."""
+        ...
+
+    async def aclose(self) -> None:
+        """Close the connection to the cache."""
+        ...
+
 
 class Voice:
     """An AI voice."""
 
+    __slots__ = (
+        "name",
+        "category",
+        "generator",
+        "avatar",
+        "description",
+        "is_free",
+        "cost_micros_per_char",
+        "_cost_cache",
+        "shared_cache",
+        "audio_format",
+        "_inflight",
+    )
+
     def __init__(
         self,
         name: str,
@@ -39,17 +199,236 @@ class Voice:
         generator: TTSGenerator,
         avatar: str = "",
         description: str = "",
+        is_free: bool = False,
+        cost_micros_per_char: int | None = None,
+        shared_cache: SharedAudioCache | None = None,
+        audio_format: str = "mp3",
     ):
-        self.name = name
-        self.category = category
+        # Interned, as the few categories are shared by many voices and both are
+        # compared and used as dict keys when matching and grouping voices.
+        self.name = sys.intern(name)
+        self.category = sys.intern(category)
         self.generator = generator
         self.avatar = avatar
         self.description = description
+        # Local voices cost nothing, so their cost doesn't need calculating.
+        self.is_free = is_free
+        # Flat per-character price, if the provider has one, so the cost is a
+        # multiplication instead of a call into the generator.
+        self.cost_micros_per_char = cost_micros_per_char
+        # Text -> cost string, oldest first (costs only depend on the text).
+        self._cost_cache: dict[str, str] = {}
+        # Cache checked before (and filled after) generating audio, if any.
+        self.shared_cache = shared_cache
+        # Format the audio is cached in (see AUDIO_SUFFIXES). Generators write it
+        # directly, so nothing is re-encoded.
+        self.audio_format = audio_format
+        # Generations in progress, keyed by output path, so concurrent requests for
+        # the same audio share one generator call.
+        self._inflight: dict[pathlib.Path, asyncio.Future] = {}
+
+    def cost_micros(self, text: str) -> int:
+        """The cost of generating this TTS message, in millionths of a dollar."""
+        if self.cost_micros_per_char is not None:
+            return len(text) * self.cost_micros_per_char
+        return self.generator.cost_micros(text)
 
     def calculate_cost(self, text: str) -> str:
-        """Calculate the cost of generating this TTS message."""
-        return self.generator.calculate_cost(text)
+        """Calculate the cost of generating this TTS message, formatted for display."""
+        cost = self._cost_cache.pop(text, None)
+        if cost is None:
+            cost = format_cost(self.cost_micros(text))
+            if len(self._cost_cache) >= COST_CACHE_SIZE:  # keep the cache bounded
+                del self._cost_cache[next(iter(self._cost_cache))]
+        self._cost_cache[text] = cost  # (re)insert as the most recently used
+        return cost
+
+    def cache_key(self, text: str) -> str:
+        """A stable key for this voice speaking some text, used to name cached audio."""
+        # A fast non-cryptographic hash; keep it stable, as cached file names use it.
+        return xxhash.xxh3_128_hexdigest(f"{self.name}\0{text}".encode())
+
+    def cache_path(self, directory: pathlib.Path, text: str) -> pathlib.Path:
+        """The path of the cached audio file for this voice speaking some text."""
+        suffix = AUDIO_SUFFIXES[self.audio_format]
+        return directory / f"{self.cache_key(text)}{suffix}"
+
+    async def save_audio(self, text: str, path: pathlib.Path) -> pathlib.Path:
+        """Generate audio file from text to the specified path.
+
+        Generation is skipped if the file already exists (and isn't empty), and
+        concurrent calls for the same path wait on the same generation. The
+        generators are blocking (SDK calls, local inference, ffmpeg), so they run in
+        GENERATOR_POOL to keep the event loop free.
+        """
+        if path.exists() and path.stat().st_size > 0:
+            return path
+
+        future = self._inflight.get(path)
+        if future is None:
+            future = asyncio.ensure_future(self._generate(text, path))
+            self._inflight[path] = future
+            future.add_done_callback(lambda _: self._inflight.pop(path, None))
+
+        # Shielded so one caller giving up doesn't cancel the others' generation.
+        return await asyncio.shield(future)
+
+    async def _generate(self, text: str, path: pathlib.Path) -> pathlib.Path:
+        """Fetch the audio from the shared cache, or generate it and share it."""
+        loop = asyncio.get_running_loop()
+        key = self.cache_path(pathlib.Path(), text).name
+
+        if self.shared_cache is not None:
+            try:
+                data = await self.shared_cache.get(key)
+            except Exception as e:
+                print(f"Warning: shared audio cache lookup failed: {e}")
+                data = None
+            if data:
+                return await loop.run_in_executor(
+                    GENERATOR_POOL, save_atomically, path, lambda p: p.write_bytes(data)
+                )
+
+        save = functools.partial(
+            self.generator.save_audio, text, audio_format=self.audio_format
+        )
+        await loop.run_in_executor(GENERATOR_POOL, save_atomically, path, save)
+
+        if self.shared_cache is not None:
+            try:
+                data = await asyncio.to_thread(path.read_bytes)
+                await self.shared_cache.set(key, data, SHARED_CACHE_TTL)
+            except Exception as e:
+                print(f"Warning: failed to share generated audio: {e}")
+        return path
+
+    async def save_audio_batch(
+        self, items: "list[tuple[str, pathlib.Path]]"
+    ) -> "list[pathlib.Path]":
+        """Generate several audio files with one generator call.
+
+        Like save_audio, files that already exist are skipped and files already
+        being generated are waited on. With a shared cache, each file goes through
+        save_audio instead, to use the cache.
+        """
+        if self.shared_cache is not None:
+            return list(
+                await asyncio.gather(
+                    *(self.save_audio(text, path) for text, path in items)
+                )
+            )
+
+        missing = {
+            path: text
+            for text, path in items
+            if not (path.exists() and path.stat().st_size > 0)
+            and path not in self._inflight
+        }
+        batch_futures = {}
+        if missing:
+            batch = asyncio.get_running_loop().run_in_executor(
+                GENERATOR_POOL,
+                save_batch_atomically,
+                self.generator,
+                [(text, path) for path, text in missing.items()],
+                self.audio_format,
+            )
+            # Register every file in the batch, so a save_audio call for one of them
+            # waits on the batch instead of starting a second generation.
+            for path in missing:
+                future = asyncio.ensure_future(_wait_for_batch(batch, path))
+                self._inflight[path] = future
+                future.add_done_callback(
+                    lambda _, path=path: self._inflight.pop(path, None)
+                )
+                batch_futures[path] = future
+        waits = [
+            (
+                asyncio.shield(batch_futures[path])
+                if path in batch_futures
+                else self.save_audio(text, path)
+            )
+            for text, path in items
+        ]
+        return list(await asyncio.gather(*waits))
+
+    async def prewarm(
+        self, phrases: "list[str]", directory: pathlib.Path
+    ) -> "list[pathlib.Path]":
+        """Generate the cached audio for some phrases ahead of time.
+
+        Phrases that are already cached in the directory are skipped.
+        """
+        items = [(phrase, self.cache_path(directory, phrase)) for phrase in phrases]
+        return await self.save_audio_batch(items)
+
+
+class VoiceRegistry(Sequence[Voice]):
+    """The loaded voices, indexed for looking them up by name, phrase and category.
+
+    The lowercase names and categories are also kept in lists parallel to the
+    voices, so searching and filtering scan plain strings instead of every Voice.
+    """
+
+    __slots__ = (
+        "voices",
+        "names_lower",
+        "categories",
+        "max_name_words",
+        "_by_name",
+        "_by_phrase",
+        "_by_category",
+    )
+
+    def __init__(self, voices: Iterable[Voice] = ()):
+        self.voices = tuple(voices)
+        self.names_lower = [voice.name.lower() for voice in self.voices]
+        self.categories = [voice.category for voice in self.voices]
+        # The longest voice name in words, the most a phrase lookup needs to try.
+        self.max_name_words = max(
+            (len(name.split()) for name in self.names_lower), default=0
+        )
+        # Lowercase name -> Voice, every phrase that selects a voice (see
+        # name_phrases) -> Voice, and category -> voice indexes. The first voice
+        # wins if names or phrases collide.
+        self._by_name: dict[str, Voice] = {}
+        self._by_phrase: dict[str, Voice] = {}
+        self._by_category: dict[str, list[int]] = {}
+        for index, voice in enumerate(self.voices):
+            self._by_name.setdefault(self.names_lower[index], voice)
+            for phrase in name_phrases(voice.name):
+                self._by_phrase.setdefault(phrase, voice)
+            self._by_category.setdefault(self.categories[index], []).append(index)
+
+    def __getitem__(self, index):
+        return self.voices[index]
+
+    def __len__(self) -> int:
+        return len(self.voices)
+
+    def by_name(self, name: str) -> Voice | None:
+        """Get a voice by its full name, case insensitive."""
+        return self._by_name.get(name.lower())
+
+    def by_phrase(self, phrase: str) -> Voice | None:
+        """Get the voice selected by a lowercase phrase (see name_phrases)."""
+        return self._by_phrase.get(phrase)
+
+    def search(self, name: str) -> Voice | None:
+        """Get a voice by full name, else the first whose name contains name."""
+        name = name.lower()
+        voice = self._by_name.get(name)
+        if voice is not None:
+            return voice
+        for index, voice_name in enumerate(self.names_lower):
+            if name in voice_name:
+                return self.voices[index]
+        return None
+
+    def category_names(self) -> "list[str]":
+        """The categories of the voices, in load order."""
+        return list(self._by_category)
 
-    def save_audio(self, text: str, path: pathlib.Path):
-        """Generate audio file from text to the specified path."""
-        return self.generator.save_audio(text, path)
+    def in_category(self, category: str) -> "list[Voice]":
+        """The voices in a category, in load order."""
+        return [self.voices[index] for index in self._by_category.get(category, ())]